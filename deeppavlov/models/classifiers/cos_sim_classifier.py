@@ -17,8 +17,8 @@ from logging import getLogger
 from typing import List, Tuple, Union
 
 import numpy as np
-from scipy.sparse import vstack, csr_matrix
-from scipy.sparse.linalg import norm as sparse_norm
+from scipy.sparse import vstack, csr_matrix, issparse
+from sklearn.preprocessing import normalize
 
 from deeppavlov.core.common.file import load_pickle
 from deeppavlov.core.common.file import save_pickle
@@ -35,6 +35,7 @@ class CosineSimilarityClassifier(Estimator, Serializable):
     Classifier based on cosine similarity between vectorized sentences
 
     Parameters:
+        top_n: number of most similar answers to return for each question
         save_path: path to save the model
         load_path: path to load the model
     """
@@ -43,12 +44,13 @@ class CosineSimilarityClassifier(Estimator, Serializable):
         super().__init__(save_path=save_path, load_path=load_path, **kwargs)
         self.top_n = top_n
 
-        self.x_train_features = self.y_train = None
+        self.x_train_features = self.x_train_features_T = self.y_train = None
+        self.y_labels = self.y_codes = self._label_order = self._label_bounds = None
 
         if kwargs['mode'] != 'train':
             self.load()
 
-    def __call__(self, q_vects: Union[csr_matrix, List]) -> Tuple[List[str], List[int]]:
+    def __call__(self, q_vects: Union[csr_matrix, List]) -> Tuple[List[str], List[float]]:
         """Found most similar answer for input vectorized question
 
         Parameters:
@@ -58,45 +60,47 @@ class CosineSimilarityClassifier(Estimator, Serializable):
             Tuple of Answer and Score
         """
 
+        # train vectors are l2-normalized in fit, so product of normalized vectors is cosine similarity
         if isinstance(q_vects[0], csr_matrix):
-            q_norm = sparse_norm(q_vects)
-            if q_norm == 0.0:
-                cos_similarities = np.zeros((q_vects.shape[0], self.x_train_features.shape[0]))
-            else:
-                norm = q_norm * sparse_norm(self.x_train_features, axis=1)
-                cos_similarities = np.array(q_vects.dot(self.x_train_features.T).todense())
-                cos_similarities = cos_similarities / norm
+            cos_similarities = normalize(q_vects.astype(np.float32)).dot(self.x_train_features_T).toarray()
         elif isinstance(q_vects[0], np.ndarray):
-            q_vects = np.array(q_vects)
-            self.x_train_features = np.array(self.x_train_features)
-            norm = np.linalg.norm(q_vects) * np.linalg.norm(self.x_train_features, axis=1)
-            cos_similarities = q_vects.dot(self.x_train_features.T) / norm
+            cos_similarities = normalize(np.array(q_vects, dtype=np.float32), copy=False).dot(self.x_train_features_T)
         elif q_vects[0] is None:
             cos_similarities = np.zeros(len(self.x_train_features))
         else:
             raise NotImplementedError('Not implemented this type of vectors')
 
-        # get cosine similarity for each class
-        y_labels = np.unique(self.y_train)
-        labels_scores = np.zeros((len(cos_similarities), len(y_labels)))
-        for i, label in enumerate(y_labels):
-            labels_scores[:, i] = np.max([cos_similarities[:, i]
-                                          for i, value in enumerate(self.y_train) if value == label], axis=0)
+        top_n = min(self.top_n, len(self.y_labels))
+        answer_ids, answer_scores = self._top_n_labels(cos_similarities, top_n)
+
+        # generate top_n answers and scores
+        answers = self.y_labels[answer_ids].ravel().tolist()
+        scores = np.round(answer_scores, 2).ravel().tolist()
+
+        return answers, scores
+
+    def _top_n_labels(self, cos_similarities: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get top_n labels ids and their normalized scores in descending order"""
+        # get cosine similarity for each class: columns are already grouped by label, maximum is taken per group
+        labels_scores = np.maximum.reduceat(cos_similarities, self._label_bounds, axis=1)
 
         labels_scores_sum = labels_scores.sum(axis=1, keepdims=True)
         labels_scores = np.divide(labels_scores, labels_scores_sum,
                                   out=np.zeros_like(labels_scores), where=(labels_scores_sum != 0))
 
-        answer_ids = np.argsort(labels_scores)[:, -self.top_n:]
+        # partially sort scores to get top_n-th largest score, labels above it are always in top_n
+        threshold = np.partition(labels_scores, -top_n, axis=1)[:, -top_n, None]
+        above = labels_scores > threshold
+        tied = labels_scores == threshold
+        # labels tied at threshold with the highest ids are taken, as full argsort in ascending order would do
+        tied &= np.cumsum(tied[:, ::-1], axis=1)[:, ::-1] <= top_n - above.sum(axis=1, keepdims=True)
+        answer_ids = np.nonzero(above | tied)[1].reshape(-1, top_n)
 
-        # generate top_n answers and scores
-        answers = []
-        scores = []
-        for i in range(len(answer_ids)):
-            answers.extend([y_labels[id] for id in answer_ids[i, ::-1]])
-            scores.extend([np.round(labels_scores[i, id], 2) for id in answer_ids[i, ::-1]])
+        # order only top_n labels, higher ids go first on equal scores
+        rows = np.arange(len(labels_scores))[:, None]
+        answer_ids = answer_ids[rows, np.argsort(labels_scores[rows, answer_ids], axis=1, kind='mergesort')][:, ::-1]
 
-        return answers, scores
+        return answer_ids, labels_scores[rows, answer_ids].astype(np.float64)
 
     def fit(self, x_train_vects: Tuple[Union[csr_matrix, List]], y_train: Tuple[str]) -> None:
         """Train classifier
@@ -118,10 +122,30 @@ class CosineSimilarityClassifier(Estimator, Serializable):
                     raise NotImplementedError('Not implemented this type of vectors')
             else:
                 raise ValueError("Train vectors can't be empty")
-        else:
+        elif issparse(x_train_vects):
             self.x_train_features = x_train_vects
+        else:
+            self.x_train_features = np.array(x_train_vects)
 
+        # single precision is enough for cosine similarity and halves memory traffic of the product
+        self.x_train_features = normalize(self.x_train_features.astype(np.float32))
         self.y_train = list(y_train)
+        self.y_labels, self.y_codes = np.unique(self.y_train, return_inverse=True)
+        self._group_labels()
+        self.x_train_features_T = self._get_train_features_T()
+
+    def _get_train_features_T(self) -> Union[csr_matrix, np.ndarray]:
+        """Transpose train vectors once, sparse ones are kept in CSR format expected by sparse matrix product"""
+        # columns are grouped by label, so similarities come out ready for per-label reduction
+        x_train_features = self.x_train_features[self._label_order]
+        if issparse(x_train_features):
+            return x_train_features.T.tocsr()
+        return x_train_features.T
+
+    def _group_labels(self) -> None:
+        """Precompute order of train vectors grouping them by label and boundaries of the groups"""
+        self._label_order = np.argsort(self.y_codes, kind='mergesort')
+        self._label_bounds = np.searchsorted(self.y_codes[self._label_order], np.arange(len(self.y_labels)))
 
     def save(self) -> None:
         """Save classifier parameters"""
@@ -131,4 +155,11 @@ class CosineSimilarityClassifier(Estimator, Serializable):
     def load(self) -> None:
         """Load classifier parameters"""
         logger.info("Loading faq_model from {}".format(self.load_path))
-        self.x_train_features, self.y_train = load_pickle(self.load_path)
+        x_train_features, self.y_train = load_pickle(self.load_path)
+        if not issparse(x_train_features):
+            x_train_features = np.array(x_train_features)
+        # normalization is idempotent, so models saved with unnormalized features are still supported
+        self.x_train_features = normalize(x_train_features.astype(np.float32))
+        self.y_labels, self.y_codes = np.unique(self.y_train, return_inverse=True)
+        self._group_labels()
+        self.x_train_features_T = self._get_train_features_T()
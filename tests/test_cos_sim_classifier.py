@@ -0,0 +1,94 @@
+import pickle
+
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+from deeppavlov.models.classifiers.cos_sim_classifier import CosineSimilarityClassifier
+
+N_TRAIN, N_FEATURES, N_LABELS = 60, 20, 7
+
+
+def reference(x_train, y_train, queries, top_n):
+    """Brute-force answers and scores: ties are broken by higher label first, as argsort in ascending order does"""
+    labels = sorted(set(y_train))
+    answers, scores = [], []
+    for q in queries:
+        norms = np.linalg.norm(x_train, axis=1) * np.linalg.norm(q)
+        sims = [x.dot(q) / norm if norm else 0.0 for x, norm in zip(x_train, norms)]
+        labels_scores = np.array([max(s for s, y in zip(sims, y_train) if y == label) for label in labels])
+        if labels_scores.sum() != 0:
+            labels_scores = labels_scores / labels_scores.sum()
+        else:
+            labels_scores = np.zeros_like(labels_scores)
+        order = sorted(range(len(labels)), key=lambda i: (labels_scores[i], i), reverse=True)[:top_n]
+        answers.extend(labels[i] for i in order)
+        scores.extend(labels_scores[i] for i in order)
+    return answers, scores
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(42)
+    x_train = rng.rand(N_TRAIN, N_FEATURES) * (rng.rand(N_TRAIN, N_FEATURES) < 0.3)
+    x_train[[3, 17]] = 0
+    y_train = ['answer_{}'.format(i % N_LABELS) for i in range(N_TRAIN)]
+    queries = rng.rand(5, N_FEATURES) * (rng.rand(5, N_FEATURES) < 0.5)
+    queries[2] = 0
+    return x_train, y_train, queries
+
+
+def check(result, expected):
+    assert result[0] == expected[0]
+    assert np.allclose(result[1], np.round(expected[1], 2), atol=1e-9)
+
+
+def build(tmpdir, **kwargs):
+    return CosineSimilarityClassifier(save_path=str(tmpdir.join('model.pkl')), mode='train', **kwargs)
+
+
+@pytest.mark.parametrize('top_n', [1, 3, N_LABELS + 2])
+def test_sparse(tmpdir, data, top_n):
+    x_train, y_train, queries = data
+    classifier = build(tmpdir, top_n=top_n)
+    classifier.fit(tuple(csr_matrix(x) for x in x_train), tuple(y_train))
+    check(classifier(csr_matrix(queries)), reference(x_train, y_train, queries, top_n))
+
+
+@pytest.mark.parametrize('top_n', [1, 3, N_LABELS + 2])
+def test_dense(tmpdir, data, top_n):
+    x_train, y_train, queries = data
+    classifier = build(tmpdir, top_n=top_n)
+    classifier.fit(tuple(x_train), tuple(y_train))
+    check(classifier(list(queries)), reference(x_train, y_train, queries, top_n))
+
+
+def test_zero_query(tmpdir, data):
+    x_train, y_train, _ = data
+    classifier = build(tmpdir, top_n=3)
+    classifier.fit(tuple(csr_matrix(x) for x in x_train), tuple(y_train))
+    answers, scores = classifier(csr_matrix(np.zeros((1, N_FEATURES))))
+    assert answers == ['answer_6', 'answer_5', 'answer_4']
+    assert scores == [0.0, 0.0, 0.0]
+
+
+def test_save_load(tmpdir, data):
+    x_train, y_train, queries = data
+    classifier = build(tmpdir, top_n=3)
+    classifier.fit(tuple(csr_matrix(x) for x in x_train), tuple(y_train))
+    classifier.save()
+
+    with open(str(tmpdir.join('model.pkl')), 'rb') as f:
+        assert len(pickle.load(f)) == 2
+
+    loaded = CosineSimilarityClassifier(top_n=3, load_path=str(tmpdir.join('model.pkl')), mode='infer')
+    check(loaded(csr_matrix(queries)), reference(x_train, y_train, queries, 3))
+
+
+def test_load_legacy_pickle(tmpdir, data):
+    x_train, y_train, queries = data
+    with open(str(tmpdir.join('legacy.pkl')), 'wb') as f:
+        pickle.dump((csr_matrix(x_train), list(y_train)), f)
+
+    loaded = CosineSimilarityClassifier(top_n=3, load_path=str(tmpdir.join('legacy.pkl')), mode='infer')
+    check(loaded(csr_matrix(queries)), reference(x_train, y_train, queries, 3))